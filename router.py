@@ -1,27 +1,60 @@
+import os
 import sys
 import socket
+import time
+import atexit
+import logging
+import queue
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener
 from utilities import *
 
-if __name__ == '__main__':
-
-  # Instanciamos el socket
-  conn_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+def main():
+  """Función principal del router. Se define como función, y no directamente bajo
+  if __name__ == '__main__', para que todas las variables usadas en el ciclo de
+  recepción sean locales, cuyo acceso es más rápido que el de variables globales.
+  """
 
   # Definimos el tamaño de buffer
   buff_size = 1024
 
+  # Definimos la cantidad máxima de paquetes a recibir por llamada al sistema
+  batch_size = 64
+
+  # Definimos la cantidad máxima de datagramas a medio reensamblar, y el tiempo en
+  # segundos tras el cual se descartan los fragmentos de un datagrama incompleto
+  max_partial_datagrams = 64
+  reassembly_timeout = 30
+
+  # Definimos el tamaño en bytes de los buffers de envío y recepción del socket en el
+  # kernel, para absorber ráfagas de datagramas sin descartarlos
+  socket_buff_size = 8 * 1024 * 1024
+
   # Parseamos los argumentos
   try:
 
-    if len(sys.argv) == 4:
+    if len(sys.argv) == 4 or len(sys.argv) == 6:
 
       router_IP = sys.argv[1]
       router_port = int(sys.argv[2])
       routing_table_file_name = sys.argv[3]
 
+      # Por defecto el router corre en un solo proceso
+      workers = 1
+
+      # Si se pasa --workers N, el router corre en N procesos
+      if len(sys.argv) == 6:
+        if sys.argv[4] != '--workers':
+          raise Exception(f'Unexpected argument {sys.argv[4]}, expected --workers')
+        workers = int(sys.argv[5])
+        if workers < 1:
+          raise Exception(f'Expected at least 1 worker, {workers} were given')
+        if workers > 1 and not (hasattr(os, 'fork') and hasattr(socket, 'SO_REUSEPORT')):
+          raise Exception('--workers requires os.fork and SO_REUSEPORT')
+
     # Si no se pasan correctamente los argumentos levantamos una exepción
     else:
-      raise Exception(f'Expected 3 arguments, {len(sys.argv) - 1} were given')
+      raise Exception(f'Expected 3 arguments (plus optional --workers N), {len(sys.argv) - 1} were given')
 
   except Exception as err:
     print(err)
@@ -29,83 +62,162 @@ if __name__ == '__main__':
   # Si no se levanta ningun error proseguimos
   else:
 
-    # Hacemos que el socket escuche de forma no bloqueante en el par (router_IP, router_port)
-    conn_socket.bind((router_IP, router_port))
-
-    # Instanciamos una tabla de ruteo de tipo RoundRobinRoutingTable
+    # Instanciamos una tabla de ruteo de tipo RoundRobinRoutingTable. Se hace antes de
+    # crear los procesos hijos para que estos compartan la tabla ya parseada
     round_robin_routing_table = RoundRobinRoutingTable(routing_table_file_name)
 
-    # Creamos el diccionario donde almacenar los fragmentos
-    fragment_dict = {}
+    # Creamos los workers - 1 procesos hijos, donde el proceso original es el worker 0
+    worker_index = 0
+    for i in range(1, workers):
+      if os.fork() == 0:
+        worker_index = i
+        break
+
+    # Si hay más de un worker, fijamos cada uno a una CPU distinta
+    worker_cpu = None
+    if workers > 1 and hasattr(os, 'sched_setaffinity'):
+      cpus = sorted(os.sched_getaffinity(0))
+      worker_cpu = cpus[worker_index % len(cpus)]
+      os.sched_setaffinity(0, {worker_cpu})
+
+    # Instanciamos el socket. Si hay más de un worker, cada uno crea su propio socket con
+    # SO_REUSEPORT, de modo que el kernel reparta los datagramas entre ellos según su origen
+    conn_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if workers > 1:
+      conn_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+    # Si el worker está fijado a una CPU, le indicamos al kernel que prefiera entregarle
+    # los datagramas recibidos en esa misma CPU
+    if worker_cpu is not None and hasattr(socket, 'SO_INCOMING_CPU'):
+      conn_socket.setsockopt(socket.SOL_SOCKET, socket.SO_INCOMING_CPU, worker_cpu)
+
+    # Agrandamos los buffers del socket (el kernel los limita a net.core.rmem_max y
+    # net.core.wmem_max)
+    conn_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, socket_buff_size)
+    conn_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, socket_buff_size)
+
+    # Hacemos que el socket escuche en el par (router_IP, router_port)
+    conn_socket.bind((router_IP, router_port))
+
+    # Creamos el diccionario donde almacenar los fragmentos, que mapea cada id a un par
+    # (lista de fragmentos, instante en que llegó el primero). Al ser un OrderedDict, las
+    # ids quedan ordenadas desde la más antigua a la más reciente
+    fragment_dict = OrderedDict()
+
+    # Instanciamos el receptor de lotes de paquetes
+    batch_receiver = BatchReceiver(conn_socket, buff_size, batch_size)
+
+    # Los mensajes del router se registran mediante un logger que solo encola cada
+    # registro, y es un hilo aparte el que los escribe en pantalla. Así el ciclo de
+    # recepción no queda esperando a que termine cada escritura. Al salir se vacía la cola
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger('router')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(QueueHandler(log_queue))
+    log_listener = QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+    log_listener.start()
+    atexit.register(log_listener.stop)
 
     # Recibimos paquetes de forma indefinida
     while True:
       
-      # Recibimos un paquete
-      ip_header_buffer, _ = conn_socket.recvfrom(buff_size)
-
-      # Parseamos su contenido
-      ip_header = parse_ip_header(ip_header_buffer.decode())
-
-      # Si el TTL del paquete es menor o igual a 0, luego ignoramos el paquete y 
-      # seguimos a la siguiente iteración (puede ser menor a cero si se inicializa
-      # un paquete con un número negativo --lo cual es un error pero lo prevenimos
-      # igualmente--)
-      if ip_header.ttl <= 0:
-        continue
-
-      # Si el datagrama es para este router, intentamos reensamblar, y si aquello es
-      # satisfactorio, imprimimos el mensaje en pantalla
-      if ip_header.ip_address == router_IP and ip_header.port == router_port:
-
-        # Si no tenemos una llave para la id del datagram recibido la creamos y la
-        # mapeamos a una lista vacía.
-        if ip_header.id not in fragment_dict:
-          fragment_dict[ip_header.id] = []
-
-        # Agregamos el datagrama a la lista e intentamos reensamblar
-        fragment_dict[ip_header.id].append(ip_header_buffer.decode())
-        reassembled_datagram = reassemble_ip_packet(fragment_dict[ip_header.id])
-
-        # Si el resultado de intentar reensamblar el datagrama no es None, imprimimos
-        # el mensaje en pantalla y quitamos la llave junto con su lista asociada para
-        # poder recibir el mensaje nuevamente
-        if reassembled_datagram is not None:
-          fragment_dict.pop(ip_header.id)
-          print(parse_ip_header(reassembled_datagram).msg)
-
-      # De lo contrario buscamos como redirigir en la tabla de rutas
-      else:
-
-        # Generamos el siguiente salto
-        forward_address_link_mtu = next_hop(
-          round_robin_routing_table,
-          (ip_header.ip_address, ip_header.port)
-        )
-
-        # Si el forward adress es None, luego no se encontró como redirigir en la
-        # tabla de ruta, e imprimimos un mensaje informando aquello
-        if forward_address_link_mtu is None:
-          print('No hay rutas hacia', (ip_header.ip_address, ip_header.port), 
-                'para paquete', ip_header.ip_address)
-        
-        # De lo contrario, se encontró una forma de redirigir, e informamos aquello
+      # Recibimos un lote de paquetes
+      batch = batch_receiver.receive()
+
+      # Revisamos una vez por lote si el archivo de la tabla de rutas fue modificado, de
+      # modo de no hacer una llamada al sistema por cada paquete
+      round_robin_routing_table.refresh()
+
+      # Procesamos cada paquete del lote
+      for ip_header_buffer in batch:
+
+        # Parseamos solo los primeros campos del header, que bastan para decidir qué
+        # hacer con el paquete
+        ip_address, port, ttl, id_start = parse_ip_header_prefix(ip_header_buffer)
+
+        # Si el TTL del paquete es menor o igual a 0, luego ignoramos el paquete y 
+        # seguimos a la siguiente iteración (puede ser menor a cero si se inicializa
+        # un paquete con un número negativo --lo cual es un error pero lo prevenimos
+        # igualmente--)
+        if ttl <= 0:
+          continue
+
+        # Si el datagrama es para este router, intentamos reensamblar, y si aquello es
+        # satisfactorio, imprimimos el mensaje en pantalla
+        if ip_address == router_IP and port == router_port:
+
+          # Parseamos el header completo, ya que necesitamos su id
+          ip_header = parse_ip_header(ip_header_buffer)
+          now = time.monotonic()
+
+          # Si el datagrama no está fragmentado (offset 0 y flag 0), ya está completo, por
+          # lo que imprimimos su mensaje directamente, sin pasar por el diccionario ni
+          # volver a serializar y parsear el paquete al reensamblar
+          if ip_header.offset == 0 and not ip_header.flag:
+            logger.info('%s', ip_header.msg.decode())
+
+          # En otro caso es un fragmento, y lo guardamos junto a los demás de su datagrama
+          else:
+
+            # Si no tenemos una llave para la id del datagram recibido la creamos y la
+            # mapeamos a una lista vacía, junto con el instante actual.
+            if ip_header.id not in fragment_dict:
+              fragment_dict[ip_header.id] = ([], now)
+
+            # Agregamos el datagrama a la lista e intentamos reensamblar
+            fragments, _ = fragment_dict[ip_header.id]
+            fragments.append(ip_header_buffer)
+            reassembled_datagram = reassemble_ip_packet(fragments)
+
+            # Si el resultado de intentar reensamblar el datagrama no es None, imprimimos
+            # el mensaje en pantalla y quitamos la llave junto con su lista asociada para
+            # poder recibir el mensaje nuevamente
+            if reassembled_datagram is not None:
+              fragment_dict.pop(ip_header.id)
+              logger.info('%s', parse_ip_header(reassembled_datagram).msg.decode())
+
+          # Descartamos los datagramas incompletos más antiguos mientras se exceda la
+          # cantidad máxima permitida, o hayan expirado
+          while fragment_dict and (len(fragment_dict) > max_partial_datagrams or
+                                   now - next(iter(fragment_dict.values()))[1] > reassembly_timeout):
+            fragment_dict.popitem(last=False)
+
+        # De lo contrario buscamos como redirigir en la tabla de rutas
         else:
-          forward_address, link_mtu = forward_address_link_mtu
-          print('redirigiendo paquete', ip_header.ip_address, 'con destino final',
-                (ip_header.ip_address, ip_header.port), 'desde', (router_IP, router_port),
-                'hacia', forward_address)
-
-          # Decrementamos el TTL
-          ip_header.ttl -= 1
-
-          # Fragmentamos el paquete
-          fragments = fragment_ip_packet(ip_header_buffer.decode(), link_mtu)
-
-          # Realizamos la dirección para cada fragmento
-          for fragment in fragments:
-            conn_socket.sendto(fragment.encode(), forward_address)
-
-
 
+          # Generamos el siguiente salto
+          forward_address_link_mtu = next_hop(
+            round_robin_routing_table,
+            (ip_address, port)
+          )
+
+          # Si el forward adress es None, luego no se encontró como redirigir en la
+          # tabla de ruta, e imprimimos un mensaje informando aquello (los mensajes
+          # por paquete redirigido se omiten por completo al correr con python -O)
+          if forward_address_link_mtu is None:
+            if __debug__:
+              logger.info('No hay rutas hacia %s para paquete %s', (ip_address, port), ip_address)
+        
+          # De lo contrario, se encontró una forma de redirigir, e informamos aquello
+          else:
+            forward_address, link_mtu = forward_address_link_mtu
+            if __debug__:
+              logger.info('redirigiendo paquete %s con destino final %s desde %s hacia %s',
+                          ip_address, (ip_address, port), (router_IP, router_port), forward_address)
+
+            # Decrementamos el TTL, reescribiendo solo los primeros campos del header y
+            # copiando el resto del paquete tal cual se recibió (a través de un memoryview,
+            # para copiarlo una sola vez al concatenar)
+            forwarded_packet = f'{ip_address},{port},{ttl - 1},'.encode() + memoryview(ip_header_buffer)[id_start:]
+
+            # Fragmentamos el paquete
+            fragments = fragment_ip_packet(forwarded_packet, link_mtu)
+
+            # Enviamos cada fragmento con sendto. No se usa sendmmsg, ya que preparar sus
+            # estructuras mediante ctypes cuesta más que las llamadas al sistema ahorradas
+            for fragment in fragments:
+              conn_socket.sendto(fragment, forward_address)
 
+if __name__ == '__main__':
+  main()
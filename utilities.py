@@ -1,9 +1,58 @@
 from dataclasses import dataclass
+from functools import lru_cache
+from itertools import pairwise
 import ipaddress
-
-@dataclass
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import sys
+
+# Cargamos libc solo en Linux, que es donde existe la llamada recvmmsg.
+# En cualquier otro sistema _libc queda como None y se usa la API estándar de socket.
+_libc = None
+if sys.platform.startswith('linux'):
+  try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+  except OSError:
+    _libc = None
+
+# Flag de recvmmsg que bloquea hasta recibir el primer datagrama, y luego retorna
+# sin esperar por el resto del lote (definido en <sys/socket.h>)
+MSG_WAITFORONE = 0x10000
+
+class _IOVec(ctypes.Structure):
+  """Estructura equivalente a struct iovec de <sys/uio.h>."""
+  _fields_ = [('iov_base', ctypes.c_void_p),
+              ('iov_len', ctypes.c_size_t)]
+
+class _MsgHdr(ctypes.Structure):
+  """Estructura equivalente a struct msghdr de <sys/socket.h>."""
+  _fields_ = [('msg_name', ctypes.c_void_p),
+              ('msg_namelen', ctypes.c_uint32),
+              ('msg_iov', ctypes.POINTER(_IOVec)),
+              ('msg_iovlen', ctypes.c_size_t),
+              ('msg_control', ctypes.c_void_p),
+              ('msg_controllen', ctypes.c_size_t),
+              ('msg_flags', ctypes.c_int)]
+
+class _MMsgHdr(ctypes.Structure):
+  """Estructura equivalente a struct mmsghdr de <sys/socket.h>."""
+  _fields_ = [('msg_hdr', _MsgHdr),
+              ('msg_len', ctypes.c_uint)]
+
+if _libc is not None and hasattr(_libc, 'recvmmsg'):
+  _libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint,
+                             ctypes.c_int, ctypes.c_void_p]
+  _libc.recvmmsg.restype = ctypes.c_int
+
+@dataclass(slots=True)
 class IPHeader:
-  """Data class usada para representar un header IP.
+  """Data class usada para representar un header IP. Usa __slots__, ya que se
+  instancia por cada paquete dirigido al router y por cada paquete que se debe
+  fragmentar (los paquetes que solo se redirigen se parsean con
+  parse_ip_header_prefix, sin instanciar esta clase).
 
   Attributes:
   -----------
@@ -22,7 +71,7 @@ class IPHeader:
   flag (bool): Etiqueta que toma el valor True si quedan fragmentos después 
                del fragmento actual, y toma el valor False si este es el 
                último fragmento del datagrama original.
-  msg (str): Mensaje siendo enviado en el paquete.
+  msg (bytes): Mensaje siendo enviado en el paquete, como secuencia de bytes.
   """
 
   ip_address: str
@@ -32,30 +81,33 @@ class IPHeader:
   offset: int
   size: str
   flag: bool
-  msg: str
+  msg: bytes
 
-  def to_string(self) -> str:
-    """Método usado para tranformar esta instancia a string (inversa de
-    parse_ip_header). Podríamos hacer un override de __str__, pero nos 
-    interesa conservar ese comportamiento.
+  def to_bytes(self) -> bytes:
+    """Método usado para tranformar esta instancia a bytes (inversa de
+    parse_ip_header), que es la representación con que el paquete viaja
+    a través del socket. Solo los campos del header se codifican, el
+    mensaje ya se encuentra en bytes.
 
     Returns:
     --------
-    (str): Representación del header como str, debe ser la inversa de
-           parse_ip_header. Es decir parse_ip_header(s).to_string() == s
-           siempre se cumple.
+    (bytes): Representación del header como bytes, debe ser la inversa de
+             parse_ip_header. Es decir parse_ip_header(b).to_bytes() == b
+             siempre se cumple.
     """
-    return ','.join([self.ip_address, str(self.port), str(self.ttl), self.id,
-                     str(self.offset), self.size, '1' if self.flag else '0', self.msg])
+    flag = '1' if self.flag else '0'
+    header = f'{self.ip_address},{self.port},{self.ttl},{self.id},{self.offset},{self.size},{flag},'
+    return header.encode() + self.msg
 
-@dataclass
+@dataclass(slots=True)
 class RoutingTableLine:
   """Data class usada para representar una línea de una tabla de ruteo.
 
   Attributes:
   -----------
-  possible_ip_addresses (list[str]): Lista con todas las potenciales direcciones
-                                     IP generadas a partir de una red (CIDR).
+  network_int (int): Dirección de la red (CIDR) representada como entero.
+  netmask_int (int): Máscara de la red (CIDR) representada como entero. Una dirección
+                     IP pertenece a la red si (ip_int & netmask_int) == network_int.
   initial_port (int): Inicio del rango de puertos.
   final_port (int): Fin del rango de puertos.
   landing_ip (str): Dirección IP donde redirigir dados los valores anteriores
@@ -64,56 +116,96 @@ class RoutingTableLine:
   mtu (int): Cantidad máxima de información en bytes que podemos enviar a través del enlace.
   """
 
-  possible_ip_addresses: list[str]
+  network_int: int
+  netmask_int: int
   initial_port: int
   final_port: int
   landing_ip: str
   landing_port: int
   mtu: int
 
-class CircularArrayWithPointer:
-  """Clase usada para representar un arreglo circular, con un puntero indicando
-  cual es el proximo elemento solicitable (solo se puede solicitar un solo elemento
-  en un determinado momento).
+class BatchReceiver:
+  """Clase usada para recibir varios datagramas de un socket UDP con una sola llamada
+  al sistema, usando recvmmsg (Linux). Los buffers y las estructuras que recvmmsg
+  necesita se reservan una única vez al instanciar la clase, por lo que recibir
+  paquetes no requiere reservar memoria nueva más allá de copiar su contenido. En
+  sistemas donde recvmmsg no está disponible se espera el primer datagrama con
+  recvfrom_into sobre un único buffer reservado de antemano, y luego se vacía el socket
+  de la misma forma pero sin bloquear (MSG_DONTWAIT).
 
   Methods:
   --------
-  next:
-    Retorna el próximo elemento solicitable en el arreglo.
+  receive:
+    Retorna una lista con los datagramas recibidos en una llamada al sistema.
   """
 
-  def __init__(self, data: list):
-    self.__array = data
-    self.__n = len(data)
-    self.__pointer = 0
+  def __init__(self, conn_socket: socket.socket, buff_size: int, batch_size: int = 64):
+    self.__socket = conn_socket
+    self.__buff_size = buff_size
+    self.__batch_size = batch_size
+    self.__use_recvmmsg = _libc is not None and hasattr(_libc, 'recvmmsg')
+    self.__can_drain = hasattr(socket, 'MSG_DONTWAIT')
+
+    # Reservamos el buffer usado con recvfrom_into cuando no contamos con recvmmsg
+    if not self.__use_recvmmsg:
+      self.__buffer = bytearray(buff_size)
+      self.__view = memoryview(self.__buffer)
 
-  def next(self):
-    """Método usado para solicitar un elemento del arreglo circular. Éste retorna
-    los elementos en orden ascendente dentro de l arreglo, pero una vez llega al
-    final, vuelve al comienzo. Si el arreglo tiene largo 0, luego retorna None.
+    else:
+
+      # Reservamos un buffer por cada mensaje del lote, junto con sus iovec y mmsghdr
+      self.__buffers = [bytearray(buff_size) for _ in range(batch_size)]
+      self.__views = [memoryview(buffer) for buffer in self.__buffers]
+      self.__c_buffers = [(ctypes.c_char * buff_size).from_buffer(buffer) for buffer in self.__buffers]
+      self.__iovecs = (_IOVec * batch_size)()
+      self.__msgs = (_MMsgHdr * batch_size)()
+
+      # Cada mmsghdr apunta a un único iovec, que a su vez apunta a su buffer
+      for i in range(batch_size):
+        self.__iovecs[i].iov_base = ctypes.addressof(self.__c_buffers[i])
+        self.__iovecs[i].iov_len = buff_size
+        self.__msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.__iovecs[i])
+        self.__msgs[i].msg_hdr.msg_iovlen = 1
+
+  def receive(self) -> list[bytes]:
+    """Método usado para recibir un lote de datagramas. Bloquea hasta que llegue al
+    menos un datagrama, y luego retorna todos los que ya estén esperando en el socket,
+    hasta un máximo de batch_size.
 
     Returns:
     --------
-      Elemento en el arreglo dado por el orden anterior en que se han pedido elementos.
+    (list[bytes]): Lista con el contenido de cada datagrama recibido, en el orden
+                   en que llegaron.
     """
 
-    # Si el arreglo no tiene elementos, retornamos None
-    if self.__n == 0:
-      return None
+    # Si no contamos con recvmmsg esperamos de forma bloqueante el primer datagrama, y
+    # luego recibimos sin bloquear los que ya estén esperando en el socket
+    if not self.__use_recvmmsg:
+      n, _ = self.__socket.recvfrom_into(self.__view)
+      batch = [bytes(self.__view[:n])]
 
-    # Si el puntero está alfinal del arreglo, vuelve el puntero al comienzo
-    # y retorna el último elemento.
-    elif self.__pointer == self.__n - 1:
-      prev_pointer = self.__pointer
-      self.__pointer = 0
-      return self.__array[prev_pointer]
+      while self.__can_drain and len(batch) < self.__batch_size:
+        try:
+          n, _ = self.__socket.recvfrom_into(self.__view, 0, socket.MSG_DONTWAIT)
+        except BlockingIOError:
+          break
+        batch.append(bytes(self.__view[:n]))
 
-    # De lo contrario aumentamos el puntero en uno y retornamos el elemento en que
-    # estaba anteriormente el puntero.
-    else:
-      prev_pointer = self.__pointer
-      self.__pointer += 1
-      return self.__array[prev_pointer]
+      return batch
+
+    # Llamamos a recvmmsg, reintentando si la llamada es interrumpida por una señal
+    while True:
+      n = _libc.recvmmsg(self.__socket.fileno(), self.__msgs, self.__batch_size,
+                         MSG_WAITFORONE, None)
+      if n >= 0:
+        break
+
+      err = ctypes.get_errno()
+      if err != errno.EINTR:
+        raise OSError(err, os.strerror(err))
+
+    # Copiamos el contenido de los n buffers llenados por recvmmsg
+    return [bytes(self.__views[i][:self.__msgs[i].msg_len]) for i in range(n)]
 
 def parse_routing_table_line(routing_table_line: str) -> RoutingTableLine:
   """Función que dada una linea de una tabla de ruteo, de la forma
@@ -142,14 +234,109 @@ def parse_routing_table_line(routing_table_line: str) -> RoutingTableLine:
   landing_port = int(routing_table_line_contents_list[4])
   mtu = int(routing_table_line_contents_list[5])
 
-  # Generamos la lista con todas las potenciales direcciones IP generadas 
-  # a partir de la red (CIDR) presente en la linea.
-  possible_ip_addresses = [str(ip) for ip in ipaddress.IPv4Network(cidr_net)]
+  # Representamos la red (CIDR) presente en la linea mediante su dirección y su
+  # máscara como enteros, en vez de generar todas sus potenciales direcciones IP
+  cidr_network = ipaddress.IPv4Network(cidr_net, strict=False)
+  network_int = int(cidr_network.network_address)
+  netmask_int = int(cidr_network.netmask)
 
   # Retornamos la instancia de RoutingTableLine
-  return RoutingTableLine(possible_ip_addresses, initial_port, 
+  return RoutingTableLine(network_int, netmask_int, initial_port, 
                           final_port, landing_ip, landing_port, mtu)
 
+class PrefixTrie:
+  """Clase usada para representar un trie binario sobre los bits de direcciones IPv4,
+  donde cada red (CIDR) se almacena en el nodo cuya profundidad es el largo de su
+  prefijo. De esta forma encontrar todas las redes que contienen a una dirección IP
+  requiere recorrer a lo más 32 nodos, independiente del tamaño de la tabla.
+
+  Methods:
+  --------
+  insert:
+    Almacena un valor asociado a una red.
+  matches:
+    Retorna los valores asociados a todas las redes que contienen a una dirección IP.
+  """
+
+  def __init__(self):
+    # Cada nodo se representa como una lista [hijo_bit_0, hijo_bit_1, valores]
+    self.__root = [None, None, []]
+
+  def insert(self, network_int: int, prefix_len: int, value):
+    """Método usado para almacenar un valor asociado a la red dada por network_int
+    y prefix_len, creando los nodos intermedios que hagan falta.
+
+    Parameters:
+    -----------
+    network_int (int): Dirección de la red representada como entero.
+    prefix_len (int): Largo del prefijo de la red.
+    value: Valor a asociar a la red.
+    """
+    node = self.__root
+    for i in range(prefix_len):
+      bit = (network_int >> (31 - i)) & 1
+      if node[bit] is None:
+        node[bit] = [None, None, []]
+      node = node[bit]
+    node[2].append(value)
+
+  def matches(self, ip_int: int) -> list:
+    """Método usado para obtener los valores de todas las redes que contienen a la
+    dirección IP pasada como parámetro, recorriendo el trie bit a bit desde la raíz.
+
+    Parameters:
+    -----------
+    ip_int (int): Dirección IP representada como entero.
+
+    Returns:
+    --------
+    (list): Valores de las redes que contienen a la dirección, ordenados desde el
+            prefijo más corto al más largo.
+    """
+    node = self.__root
+    values = list(node[2])
+    for i in range(32):
+      node = node[(ip_int >> (31 - i)) & 1]
+      if node is None:
+        break
+      values.extend(node[2])
+    return values
+
+@lru_cache(maxsize=8)
+def _load_routing_table(routing_table_file_name: str, mtime: float) -> PrefixTrie:
+  """Función privada encargada de leer y parsear un archivo con una tabla de ruteo,
+  retornando un PrefixTrie con sus lineas. El resultado se guarda en caché según el
+  nombre del archivo y su fecha de modificación, de modo que todas las instancias de
+  RoundRobinRoutingTable que usen un mismo archivo comparten el trie, y el archivo solo
+  se vuelve a leer si es modificado. El caché es acotado, de modo que las versiones
+  antiguas de un archivo que cambia no se acumulen en memoria. El trie retornado no
+  debe ser modificado.
+
+  Parameters:
+  -----------
+  routing_table_file_name (str): Nombre del archivo que contiene la tabla de ruteo.
+  mtime (float): Fecha de modificación del archivo (os.path.getmtime), usada solo
+                 como parte de la llave del caché.
+
+  Returns:
+  --------
+  (PrefixTrie): Trie donde cada linea se almacena según su red, como un par
+                (posición de la linea en el archivo, RoutingTableLine).
+  """
+  trie = PrefixTrie()
+
+  # Abrimos el archivo que contiene la tabla de ruteo y lo recorremos linea a linea,
+  # insertando cada una en el trie según su red, junto con su posición en el archivo
+  # para poder conservar el orden original de las rutas. El bloque with asegura que el
+  # archivo se cierre aun si alguna linea no puede parsearse
+  with open(routing_table_file_name, 'r') as routing_table_file:
+    for i, line in enumerate(routing_table_file):
+      routing_table_line = parse_routing_table_line(line.rstrip('\n'))
+      prefix_len = bin(routing_table_line.netmask_int).count('1')
+      trie.insert(routing_table_line.network_int, prefix_len, (i, routing_table_line))
+
+  return trie
+
 class RoundRobinRoutingTable:
   """Clase usada para representar tablas de ruteo, añadiendo la funcionalidad
   de alternar forwarding de paquetes cuando existen varias rutas posibles para
@@ -160,12 +347,44 @@ class RoundRobinRoutingTable:
     self.__routing_table_file_name = routing_table_file_name
     self.__table = {}
 
+    # Obtenemos la tabla de ruteo ya parseada, de modo de no volver a leer el archivo
+    # por cada nueva dirección de destino. Guardamos además la fecha de modificación
+    # del archivo, para detectar cuando este cambia
+    self.__mtime = os.path.getmtime(routing_table_file_name)
+    self.__trie = _load_routing_table(routing_table_file_name, self.__mtime)
+
+  def refresh(self):
+    """Método usado para revisar si el archivo de la tabla de ruteo fue modificado
+    desde la última vez que se leyó. Requiere una llamada al sistema (stat), por lo que
+    no se llama por cada paquete: es quien usa la tabla quien decide cada cuánto
+    llamarlo (el router lo hace una vez por lote de paquetes recibidos). De ser el caso, se vuelve a cargar
+    la tabla y se descartan las entradas ya generadas, de modo de no seguir haciendo
+    forward por rutas que ya no existen. Si el archivo no se puede leer o parsear (por
+    ejemplo, porque se está reemplazando), se mantiene la tabla actual hasta que el
+    archivo vuelva a ser modificado.
+    """
+    try:
+      mtime = os.path.getmtime(self.__routing_table_file_name)
+    except OSError:
+      return
+
+    if mtime == self.__mtime:
+      return
+
+    self.__mtime = mtime
+    try:
+      self.__trie = _load_routing_table(self.__routing_table_file_name, mtime)
+    except (OSError, ValueError, IndexError):
+      return
+    self.__table.clear()
+
   def __generate_entry(self, destination_address: tuple[str, int]):
     """Método privado usado para generar la entrada asociada a una dirección de
-    destino en una instancia de esta clase. Esta entrada sera del tipo
-    CircularArrayWithPointer. Notemos que si no se encuentra una forma de hacer
-    forward para la dirección de destino, el arreglo circular será vacío, y al hacerle
-    next se obtendrá None, que es el comportamiento deseado.
+    destino en una instancia de esta clase. Esta entrada es un arreglo circular
+    representado como un par (tupla de formas de hacer forward, índice del próximo
+    elemento), donde el índice comienza en 0. Notemos que si no se encuentra una forma
+    de hacer forward para la dirección de destino, la tupla será vacía, y next_hop
+    retornará None, que es el comportamiento deseado.
 
     Parameters:
     -----------
@@ -176,43 +395,45 @@ class RoundRobinRoutingTable:
     # Desempaquetamos la dirección de destino por facilidad de uso
     destination_ip, destination_port = destination_address
 
-    # Creamos la lista con la cual inicializar la instancia de CircularArrayWithPointer
+    # Creamos la lista con la cual inicializar el arreglo circular
     forward_adresses_mtu_list = []
 
-    # Abrimos el archivo que contiene la tabla de ruteo y leemos sus lineas
-    routing_table_file = open(self.__routing_table_file_name, 'r')
-    routing_table_lines = routing_table_file.readlines()
+    # Representamos la IP de destino como entero. Si no es una IPv4 válida, no puede
+    # pertenecer a ninguna red de la tabla, y dejamos la lista vacía
+    try:
+      destination_ip_int = int(ipaddress.IPv4Address(destination_ip))
+    except ipaddress.AddressValueError:
+      self.__table[destination_address] = ((), 0)
+      return
 
-    # Iteramos sobre las lineas
-    for line in routing_table_lines:
+    # Obtenemos desde el trie las lineas cuya red contiene a la IP de destino, y las
+    # ordenamos según su posición en el archivo
+    matching_lines = sorted(self.__trie.matches(destination_ip_int), key=lambda match: match[0])
 
-      # Parseamos la línea
-      routing_table_line = parse_routing_table_line(line.strip('\n'))
+    # Iteramos sobre las lineas cuya red contiene a la IP de destino
+    for _, routing_table_line in matching_lines:
 
-      # Revisamos si en la linea actual se indica como hacer forward para la dirección de destino
-      if (destination_ip in routing_table_line.possible_ip_addresses and 
-          destination_port in range(routing_table_line.initial_port, routing_table_line.final_port + 1)):
+      # Revisamos si en la linea actual se indica como hacer forward para el puerto de destino
+      if routing_table_line.initial_port <= destination_port <= routing_table_line.final_port:
       
         # De ser el caso agregamos la dirección a la cual hacer forward a la lista con la cual inicializar
-        # el CircularArrayWithPointer, y asi mismo el MTU del enlace
+        # el arreglo circular, y asi mismo el MTU del enlace
         next_hop_ip, next_hop_port = (routing_table_line.landing_ip, routing_table_line.landing_port)
         link_mtu = routing_table_line.mtu
         forward_adresses_mtu_list.append(((next_hop_ip, next_hop_port), link_mtu))
 
-    # Cerramos el archivo con tabla de ruteo
-    routing_table_file.close()
-
     # Finalmente inicializamos la entrada asociada a esta dirección de destino
-    self.__table[destination_address] = CircularArrayWithPointer(forward_adresses_mtu_list)
+    self.__table[destination_address] = (tuple(forward_adresses_mtu_list), 0)
 
   def next_hop(self, destination_address: tuple[str, int]) -> tuple[tuple[str, int], int] | None:
     """Método usado para, dada la lista de ruteo con que se instancia este
     objeto, y la dirección de destino pasada como parámetro, obtener el próximo salto
     en el arreglo circular de posibles formas de hacer forward, junto con el MTU del enlace.
     Si no existe una entrada en el diccionario subyacente, este se genera antes de retornar. 
-    Notemos que si no existe una forma de hacer forward, por la manera en que está implementado 
-    el método encargado de generar el arreglo circular, y el comportamiento del arreglo circular 
-    al estar vacío, se retorna None (que es el comportamiento esperado).
+    Notemos que si no existe una forma de hacer forward, el arreglo circular generado estará
+    vacío y se retorna None (que es el comportamiento esperado). En otro caso se retorna el
+    elemento indicado por el índice del arreglo, y este avanza en uno, volviendo a 0 al
+    llegar al final.
 
     Parameters:
     -----------
@@ -227,24 +448,32 @@ class RoundRobinRoutingTable:
                                           existe una forma de hacer forward, el arreglo circular 
                                           subyacente estará vacio y por ende se retornará None.
     """
-    if destination_address in self.__table:
-      return self.__table[destination_address].next()
-    
-    else:
+    entry = self.__table.get(destination_address)
+    if entry is None:
       self.__generate_entry(destination_address)
-      return self.__table[destination_address].next()
+      entry = self.__table[destination_address]
 
+    # Si el arreglo circular no tiene elementos, retornamos None
+    forward_adresses_mtu, pointer = entry
+    if not forward_adresses_mtu:
+      return None
 
-def parse_ip_header(ip_header: str) -> IPHeader:
+    # De lo contrario avanzamos el índice y retornamos el elemento en que estaba
+    self.__table[destination_address] = (forward_adresses_mtu, (pointer + 1) % len(forward_adresses_mtu))
+    return forward_adresses_mtu[pointer]
+
+
+def parse_ip_header(ip_header: bytes) -> IPHeader:
   """Función encargada de, dado un header IP representado como
-  un string de la forma:
+  una secuencia de bytes de la forma:
     [Dirección IP],[Puerto],[TTL],[ID],[Offset],[Tamaño],[FLAG],[mensaje]
-  retornar un objeto de la data class IPHeader.
+  retornar un objeto de la data class IPHeader. Los campos del header se
+  decodifican, pero el mensaje se mantiene como bytes.
 
   Parameters:
   -----------
-  ip_header (str): Header IP representado como un string de la forma 
-                   [Dirección IP],[Puerto],[TTL],[ID],[Offset],[Tamaño],[FLAG],[mensaje]
+  ip_header (bytes): Header IP representado como bytes de la forma 
+                     [Dirección IP],[Puerto],[TTL],[ID],[Offset],[Tamaño],[FLAG],[mensaje]
   
   Returns:
   --------
@@ -252,23 +481,55 @@ def parse_ip_header(ip_header: str) -> IPHeader:
               pasado como parámetro
   """
 
-  # Extraemos el contenido del header
-  packet_contents_list = ip_header.split(',')
+  # Extraemos el contenido del header. Separamos solo en las primeras 7 comas, ya que
+  # el mensaje es el último campo y puede contener comas
+  packet_contents_list = ip_header.split(b',', 7)
 
-  # Guardamos la itnerpretación del contenido en variables ad-hoc
-  ip_address = packet_contents_list[0]
+  # Guardamos la itnerpretación del contenido en variables ad-hoc (int acepta
+  # bytes directamente, por lo que no es necesario decodificar los campos numéricos)
+  ip_address = packet_contents_list[0].decode()
   port = int(packet_contents_list[1])
   ttl = int(packet_contents_list[2])
-  id = packet_contents_list[3]
+  id = packet_contents_list[3].decode()
   offset = int(packet_contents_list[4])
-  size = packet_contents_list[5]
+  size = packet_contents_list[5].decode()
   # Asumimos que el FLAG será solo 0 o 1
-  flag = True if packet_contents_list[6] == '1' else False 
+  flag = packet_contents_list[6] == b'1'
   msg = packet_contents_list[7]
 
   # Retornamos el contenido empaquetado en una instancia de IPHeader
   return IPHeader(ip_address, port, ttl, id, offset, size, flag, msg)
 
+def parse_ip_header_prefix(ip_header: bytes) -> tuple[str, int, int, int]:
+  """Función encargada de, dado un header IP representado como bytes de la forma
+    [Dirección IP],[Puerto],[TTL],[ID],[Offset],[Tamaño],[FLAG],[mensaje]
+  parsear solo sus tres primeros campos, sin copiar el resto del paquete. Sirve para
+  decidir qué hacer con un paquete sin necesidad de parsearlo completo.
+
+  Parameters:
+  -----------
+  ip_header (bytes): Header IP representado como bytes de la forma 
+                     [Dirección IP],[Puerto],[TTL],[ID],[Offset],[Tamaño],[FLAG],[mensaje]
+
+  Returns:
+  --------
+  (tuple[str, int, int, int]): Tupla (ip_address, port, ttl, id_start), donde id_start es la
+                               posición en ip_header donde comienza el campo [ID], es decir,
+                               ip_header[id_start:] son los bytes que siguen a la coma del TTL.
+  """
+
+  # Buscamos las posiciones de las tres primeras comas
+  ip_end = ip_header.index(b',')
+  port_end = ip_header.index(b',', ip_end + 1)
+  ttl_end = ip_header.index(b',', port_end + 1)
+
+  # El campo [ID] comienza inmediatamente después de la coma que cierra el TTL
+  id_start = ttl_end + 1
+
+  # Retornamos los campos delimitados por ellas
+  return (ip_header[:ip_end].decode(), int(ip_header[ip_end + 1:port_end]),
+          int(ip_header[port_end + 1:ttl_end]), id_start)
+
 def next_hop(round_robin_routing_table: RoundRobinRoutingTable, 
              destination_address: tuple[str, int]) -> tuple[tuple[str, int], int] | None:
   """Función que dada una tabla de ruteo de tipo Round Robin, y un par
@@ -308,33 +569,31 @@ def generate_ip_header_size(size: int) -> str:
          usar como size dentro de un paquete IP.
          Ejemplo: generate_ip_header_size(255) -> '00000255'
   """
-  
-  size_in_correct_format = f'{size}'
 
-  # Mientras size_in_correct_format no tenga 8 digitos agregamos un 0 al comienzo
-  while len(size_in_correct_format) < 8:
-    size_in_correct_format = '0' + size_in_correct_format
-  
-  return size_in_correct_format
+  # El largo debe caber en 8 dígitos
+  assert 0 <= size < 10**8
 
-def fragment_ip_packet(ip_packet: str, mtu: int) -> list[str]:
+  # Rellenamos con ceros a la izquierda hasta completar 8 dígitos
+  return f'{size:08d}'
+
+def fragment_ip_packet(ip_packet: bytes, mtu: int) -> list[bytes]:
   """Función encargada de fragmentar un paquete IP dado como parametro para que quepa
   a través de un enlace con el MTU dado.
 
   Parameters:
   -----------
-  ip_packet (str): Paquete IP a fragmentar.
+  ip_packet (bytes): Paquete IP a fragmentar.
   mtu (int): MTU mediante el cual fragmentar el paquete IP.
 
   Returns:
   --------
-  (list[str]): Lista que contiene al paquete IP fragmentado usando el MTU pasado como
-               parámetro.
+  (list[bytes]): Lista que contiene al paquete IP fragmentado usando el MTU pasado como
+                 parámetro.
   """
 
   # Si el largo en bytes del paquete es menor o igual a MTU, csgnifica que 
   # cabe completo por el enalce y por ende no es necesario fragmentarlo.
-  if len(ip_packet.encode()) <= mtu:
+  if len(ip_packet) <= mtu:
     return [ip_packet]
 
   # De lo contrario es necesario llevar a cabo fragmentación.
@@ -355,122 +614,103 @@ def fragment_ip_packet(ip_packet: str, mtu: int) -> list[str]:
     ttl = parsed_ip_packet.ttl
     id = parsed_ip_packet.id
 
+    # Calculamos una única vez el largo del mensaje, y la parte del header que comparten
+    # todos los fragmentos junto con su largo en bytes
+    msg_len = len(msg)
+    header_prefix = f'{ip_address},{port},{ttl},{id},'.encode()
+    header_prefix_len = len(header_prefix)
+
     # Creamos una variable donde almacenar el offset dentro de este mensaje; puede darse,
     # si ip_packet es un fragmento, que offset_in_msg != parsed_ip_packet.offset
     offset_in_msg = 0
 
     # Iteramos mientras no hayamos recorrido el mensaje completo
-    while offset_in_msg < len(msg.encode()):
+    while offset_in_msg < msg_len:
 
       # Calculamos los headers para el fragmento actual
       curr_frag_offset = parsed_ip_packet.offset + offset_in_msg
-      curr_frag_size = '00000000'  # Usamos 8 ceros como placeholder
-      # Por defecto seteamos el flag como True, ahora, si el paquete original no es fragmento,
-      # luego ponemos el flag del último fragmento como False
-      curr_frag_flag = True
-      curr_frag_flag_as_str = '1'
 
-      # Construimos el fragment header solo para calcular su largo en bytes
-      fragment_header = f'{ip_address},{port},{ttl},{id},{curr_frag_offset},{curr_frag_size},{curr_frag_flag_as_str},'
-      fragment_header_len = len(fragment_header.encode())
+      # Calculamos el largo en bytes del header del fragmento sin construirlo: al prefijo
+      # común se suman los dígitos del offset, los 8 dígitos de size, el dígito del flag
+      # y las 3 comas que los separan
+      fragment_header_len = header_prefix_len + len(str(curr_frag_offset)) + 8 + 1 + 3
 
       # Calculamos el largo maximo de mensaje que se puede introducir en el fragmento actual
       curr_fragment_max_msg_len = mtu - fragment_header_len
 
       # Construimos el mensaje a incluir en el fragmento
-      curr_frag_msg = (msg.encode())[offset_in_msg:offset_in_msg + curr_fragment_max_msg_len]
+      curr_frag_msg = msg[offset_in_msg:offset_in_msg + curr_fragment_max_msg_len]
 
       # Asignamos el valor correcto de size
       curr_frag_size = generate_ip_header_size(len(curr_frag_msg))
 
-      # Construimos el fragmento y lo agregamos a la lista
-      curr_fragment = IPHeader(
-        ip_address, port, ttl, id, curr_frag_offset,
-        curr_frag_size, curr_frag_flag, curr_frag_msg.decode()
-      )
-      fragments_list.append(curr_fragment)
-
       # Actualizamos offset_in_msg
       offset_in_msg += len(curr_frag_msg)
 
-    # Si el paquete original no era un fragmento, marcamos el FLAG del último
-    # fragmento como False
-    if not parsed_ip_packet.flag:
-      fragments_list[-1].flag = False
+      # Por defecto el flag es 1, pero si el paquete original no es fragmento, luego
+      # el flag del último fragmento es 0
+      curr_frag_flag_as_str = '0' if offset_in_msg >= msg_len and not parsed_ip_packet.flag else '1'
 
-    # Finalmente hacemos un map a la lista de fragmentos pasando cada fragmento
-    # a su representación como string, y la retornamos
-    fragments_list = list(map(lambda ip_header: ip_header.to_string(), fragments_list))
+      # Construimos el fragmento directamente como bytes y lo agregamos a la lista
+      fragments_list.append(
+        header_prefix + f'{curr_frag_offset},{curr_frag_size},{curr_frag_flag_as_str},'.encode() + curr_frag_msg
+      )
+
+    # Finalmente retornamos la lista de fragmentos
     return fragments_list
 
-def reassemble_ip_packet(fragment_list: list[str]) -> str | None:
+def reassemble_ip_packet(fragment_list: list[bytes]) -> bytes | None:
   """Función encargada de reensamblar un paquete IP a partir de una lista
   de sus fragmentos. Si la lista de fragmentos está incompleta se retorna
   None.
 
   Parameters:
   -----------
-  fragment_list (list[str]): Lista de fragmentos a ensamblar.
+  fragment_list (list[bytes]): Lista de fragmentos a ensamblar.
 
   Returns:
   --------
-  (str | None): Si la lista de fragmentos está completa, luego se
-                retorna el paquete IP reensamblado, de lo contrario se
-                retorna None.
+  (bytes | None): Si la lista de fragmentos está completa, luego se
+                  retorna el paquete IP reensamblado, de lo contrario se
+                  retorna None.
   """
 
   # Primero mapeamos la lista a instancias de la clase IPHeader
   fragment_list = list(map(parse_ip_header, fragment_list))
 
+  # Si ningún fragmento tiene el flag en 0 (o en este caso False --los fragmentos están
+  # representados como IPHeader--), aún no ha llegado el último fragmento y podemos
+  # retornar None sin siquiera ordenar la lista
+  if all(ip_header.flag for ip_header in fragment_list):
+    return None
+
   # Luego la ordenamos de manera ascendente por el offset
-  fragment_list = sorted(fragment_list, key=lambda ip_header: ip_header.offset)
-
-  # Creamos una variable booleana donde almacenar el valor de verdad indicando
-  # que la lista de fragmentos está completa. Una primera condición que se debe
-  # cumplir es que el primer fragmento tenga offset 0, por lo que inicializamos
-  # la variable con el valor de verdad de aquella proposición.
-  fragment_list_is_complete = (fragment_list[0].offset == 0)
-
-  # A continuación hacemos una pasada por la lista revisando que esté completa
-  # y aprovechando de reensamblar el mensaje
-  i = 0
-  total_msg = fragment_list[0].msg
-  while fragment_list_is_complete and i < len(fragment_list) - 1:
-
-    # Almacenamos el fragmento actual y el siguiente
-    curr_frag = fragment_list[i]
-    next_frag = fragment_list[i+1]
-
-    # Añadimos el siguiente pedazo del mensaje
-    total_msg += next_frag.msg
-
-    # Se debe cumplir en cada posición que el offset del fragmento igual, mas
-    # el largo de su mensaje, sea igual al offset del siguiente fragmento. Donde
-    # si no se cumple dicha condición, podemos setear fragment_list_is_complete
-    # a False y romper el ciclo
-    if curr_frag.offset + int(curr_frag.size) != next_frag.offset:
-      fragment_list_is_complete = False
-      break
-
-    # Si no se rompe el ciclo aumentamos el contador en 1
-    i += 1
-
-  # Una última condición que debe cumplirse es que el flag del último fragmento sea
-  # 0 (o en este caso False --los fragmentos están representados como IPHeader--).
-  # Luego si se satisface lo contrario podemos setear fragment_list_is_complete a False
-  if fragment_list[-1].flag:
-    fragment_list_is_complete = False
-  
-  # Si la lista de fragmentos estaba completa, luego podemos reensamblar el mensaje
-  if fragment_list_is_complete:
-
-    # Creamos el paquete reensamblado primero como una instancia de IPHeader, para luego
-    # pasarlo a string y retornarlo. Podemos tomar los headers del primer fragmento, donde
-    # lo único que habría que cambiar es el flag a 0, y el tamaño al largo total del mensaje.
-    fst_frag = fragment_list[0]
-    reassembled_ip_packet = IPHeader(
-      fst_frag.ip_address, fst_frag.port, fst_frag.ttl, fst_frag.id,
-      fst_frag.offset, generate_ip_header_size(len(total_msg.encode())),
-      False, total_msg
-    )
-    return reassembled_ip_packet.to_string()
+  fragment_list.sort(key=lambda ip_header: ip_header.offset)
+
+  # Las primeras condiciones que se deben cumplir para que la lista de fragmentos esté
+  # completa son que el primer fragmento tenga offset 0, y que el último tenga flag 0
+  if fragment_list[0].offset != 0 or fragment_list[-1].flag:
+    return None
+
+  # Además se debe cumplir en cada posición que el offset del fragmento, mas su tamaño
+  # (el campo [Tamaño], convertido a entero una sola vez por fragmento), sea igual al
+  # offset del siguiente
+  frag_sizes = [int(ip_header.size) for ip_header in fragment_list]
+  if any(curr_frag.offset + curr_size != next_frag.offset
+         for (curr_frag, next_frag), curr_size in zip(pairwise(fragment_list), frag_sizes)):
+    return None
+
+  # Si la lista de fragmentos está completa, luego podemos reensamblar el mensaje,
+  # concatenando todos sus pedazos de una sola vez
+  total_msg = b''.join(ip_header.msg for ip_header in fragment_list)
+
+  # Creamos el paquete reensamblado primero como una instancia de IPHeader, para luego
+  # pasarlo a bytes y retornarlo. Podemos tomar los headers del primer fragmento, donde
+  # lo único que habría que cambiar es el flag a 0, y el tamaño al largo total del mensaje.
+  fst_frag = fragment_list[0]
+  reassembled_ip_packet = IPHeader(
+    fst_frag.ip_address, fst_frag.port, fst_frag.ttl, fst_frag.id,
+    fst_frag.offset, generate_ip_header_size(len(total_msg)),
+    False, total_msg
+  )
+  return reassembled_ip_packet.to_bytes()